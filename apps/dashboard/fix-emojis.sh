@@ -0,0 +1,69 @@
+#!/usr/bin/env bash
+# Replace emoji icons in dashboard pages with lucide-react components.
+#
+# The rewrites themselves live in emoji-edits.sed; this driver only runs sed
+# on pages that still contain one of the emojis, then imports any lucide
+# icons the rewrite introduced. Safe to re-run.
+#
+# Usage: ./fix-emojis.sh [pages_dir]
+set -euo pipefail
+
+PAGES_DIR="${1:-/opt/swarm-dashboard/src/pages}"
+EDITS="$(dirname "$0")/emoji-edits.sed"
+EMOJIS='🤖|👤|🐙'
+ICONS=(Bot User Github)
+SIDEBAR_IMPORT="import Sidebar from '../components/Sidebar';"
+
+# Pages that still need fixing (ripgrep when available)
+if command -v rg >/dev/null 2>&1; then
+  mapfile -t pages < <(rg -l -g '*.jsx' -e "$EMOJIS" "$PAGES_DIR" || true)
+else
+  mapfile -t pages < <(grep -lE "$EMOJIS" "$PAGES_DIR"/*.jsx || true)
+fi
+
+if [ "${#pages[@]}" -eq 0 ]; then
+  echo "No emoji icons left in $PAGES_DIR"
+  exit 0
+fi
+
+# sed -i would rewrite every page, so edit a copy and only move it into place
+# when it differs; unchanged pages keep their inode and mtime
+tmp=''
+trap 'rm -f "$tmp"' EXIT
+
+for page in "${pages[@]}"; do
+  tmp="$(mktemp "$page.XXXXXX")"
+  sed -f "$EDITS" "$page" > "$tmp"
+  if cmp -s "$tmp" "$page"; then
+    rm -f "$tmp"
+    continue  # emoji present, but not one of the known snippets
+  fi
+  chmod --reference="$page" "$tmp"
+  mv "$tmp" "$page"
+
+  missing=()
+  for icon in "${ICONS[@]}"; do
+    # Used by the page but not in any lucide-react import (grep -z spans lines)
+    if grep -q "<$icon size=" "$page" &&
+       ! grep -qzE "import \{[^}]*\b$icon\b[^}]*\} from 'lucide-react';" "$page"; then
+      missing+=("$icon")
+    fi
+  done
+
+  if [ "${#missing[@]}" -gt 0 ]; then
+    names="$(IFS=,; echo "${missing[*]}" | sed 's/,/, /g')"
+    line="import { $names } from 'lucide-react';"
+    if grep -q "from 'lucide-react';" "$page"; then
+      sed -i "0,/from 'lucide-react';/s//&\n$line/" "$page"
+    elif grep -qF "$SIDEBAR_IMPORT" "$page"; then
+      sed -i "0,/import Sidebar from '..\/components\/Sidebar';/s//&\n$line/" "$page"
+    else
+      sed -i "1i $line" "$page"
+    fi
+  fi
+
+  echo "Fixed $(basename "$page")"
+done
+
+echo
+echo "All emoji fixes applied!"
@@ -1,52 +1,49 @@
 #!/usr/bin/env python3
 import re
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 pages_dir = '/opt/swarm-dashboard/src/pages'
 files = ['Tickets.jsx', 'KanbanBoard.jsx', 'AgentMonitor.jsx', 'CreateProject.jsx', 
          'AdminUsers.jsx', 'Secrets.jsx', 'DesignSession.jsx', 'SpecReview.jsx']
 
-# Pattern to match the old header/nav structure
-nav_pattern = re.compile(
-    r'<nav className="dashboard-nav">.*?</nav>',
-    re.DOTALL
-)
+wrapper_pattern = re.compile(r'<div className="dashboard[^"]*">')
 
-header_pattern = re.compile(
-    r'<header className="dashboard-header">.*?</header>',
-    re.DOTALL
-)
 
-for filename in files:
+def strip_between(content, open_tag, close_tag, replacement=''):
+    """Replace the first open_tag...close_tag section, leaving content alone if either is missing."""
+    start = content.find(open_tag)
+    if start < 0:
+        return content
+    end = content.find(close_tag, start + len(open_tag))
+    if end < 0:
+        return content
+    return content[:start] + replacement + content[end + len(close_tag):]
+
+
+def process(filename):
+    """Update one page in place, returning a status line for the caller to print."""
     filepath = os.path.join(pages_dir, filename)
     if not os.path.exists(filepath):
-        print(f"Skipping {filename} - not found")
-        continue
-    
-    print(f"Processing {filename}...")
+        return f"Skipping {filename} - not found"
     
     with open(filepath, 'r') as f:
-        content = f.read()
+        original = f.read()
     
     # Replace UserMenu import with Sidebar
-    content = content.replace(
+    content = original.replace(
         "import UserMenu from '../components/UserMenu';",
         "import Sidebar from '../components/Sidebar';"
     )
     
     # Remove the header section
-    content = header_pattern.sub('', content)
+    content = strip_between(content, '<header className="dashboard-header">', '</header>')
     
     # Remove the nav section
-    content = nav_pattern.sub('<Sidebar />', content, count=1)
+    content = strip_between(content, '<nav className="dashboard-nav">', '</nav>', '<Sidebar />')
     
     # Update wrapper class
-    content = re.sub(
-        r'<div className="dashboard[^"]*">',
-        '<div className="page-container">',
-        content,
-        count=1
-    )
+    content = wrapper_pattern.sub('<div className="page-container">', content, count=1)
     
     # Update main class
     content = content.replace('dashboard-main', 'page-main')
@@ -54,9 +51,18 @@ for filename in files:
     # Clean up any leftover UserMenu references
     content = content.replace('<UserMenu />', '')
     
+    if content == original:
+        return f"  {filename} already up to date"
+    
     with open(filepath, 'w') as f:
         f.write(content)
     
-    print(f"  Updated {filename}")
+    return f"  Updated {filename}"
+
+
+# Pages are independent, so overlap their reads and writes
+with ThreadPoolExecutor(max_workers=8) as executor:
+    for status in executor.map(process, files):
+        print(status)
 
 print("\nAll pages updated!")
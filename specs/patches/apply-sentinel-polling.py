@@ -6,9 +6,13 @@ Adds sentinel review polling and PR merge logic
 Usage: python3 apply-sentinel-polling.py
 """
 
-import re
+import mmap
+import shutil
+
+from patch_utils import ENGINE_ANCHORS, already_applied, find_anchors, record_applied, replacing
 
 ENGINE_PATH = '/opt/swarm/engine/lib/engine.js'
+MARKER_SUFFIX = '.patch-sentinel'
 
 # Method 1: getReviewTickets - Insert after getTicket method
 GET_REVIEW_TICKETS = '''
@@ -95,6 +99,9 @@ STATE_TRANSITIONS = '''
 
 # Method 3: Sentinel review execution - Insert before _pollLoop
 SENTINEL_REVIEW = '''
+    // GitHub PR URL -> owner, repo, PR number; compiled once with the class
+    static PR_URL_RE = /github\\.com\\/([^\\/]+)\\/([^\\/]+)\\/pull\\/(\\d+)/;
+
     /**
      * Execute sentinel review on a ticket's PR
      * Reviews the PR diff against acceptance criteria
@@ -175,7 +182,7 @@ SENTINEL_REVIEW = '''
      * Merge a PR via GitHub CLI
      */
     async mergePR(ticketId, prUrl, branchName) {
-        const match = prUrl.match(/github\\.com\\/([^\\/]+)\\/([^\\/]+)\\/pull\\/(\\d+)/);
+        const match = prUrl.match(this.constructor.PR_URL_RE);
         if (!match) throw new Error(`Invalid PR URL: ${prUrl}`);
         
         const [, owner, repo, prNumber] = match;
@@ -208,117 +215,132 @@ SENTINEL_REVIEW = '''
 SENTINEL_POLL_CODE = '''
         // =========== SENTINEL REVIEW POLLING ===========
         if (!this.shuttingDown) {
+            // LIMIT already caps the batch at the free slots
             const reviewTickets = await this.getReviewTickets(Math.max(1, available - dispatched));
-            for (const ticket of reviewTickets) {
-                if (this.shuttingDown) break;
-                log('INFO', `[SENTINEL] Found review ticket: ${ticket.id}`);
-                this.executeSentinelReview(ticket).catch(err => {
-                    log('ERROR', `[SENTINEL] Async review error for ${ticket.id}: ${err.message}`);
-                });
-                dispatched++;
+            if (!this.shuttingDown && reviewTickets.length > 0) {
+                log('INFO', `[SENTINEL] Found review tickets: ${reviewTickets.map(t => t.id).join(', ')}`);
+                // Dispatch the whole batch at once; polling doesn't wait on the reviews,
+                // and each failure is logged as soon as that review rejects
+                for (const ticket of reviewTickets) {
+                    this.executeSentinelReview(ticket).catch(err => {
+                        log('ERROR', `[SENTINEL] Async review error for ${ticket.id}: ${err.message}`);
+                    });
+                }
+                dispatched += reviewTickets.length;
             }
         }
         
         return dispatched;'''
 
-def apply_patch():
-    print("[1/5] Reading engine.js...")
-    with open(ENGINE_PATH, 'r') as f:
-        content = f.read()
-    
-    # Backup
-    with open(ENGINE_PATH + '.bak-sentinel', 'w') as f:
-        f.write(content)
-    print("      Backup created: engine.js.bak-sentinel")
-    
-    # Check if already patched
-    if 'getReviewTickets' in content:
-        print("[!] Engine already contains sentinel polling. Skipping patch.")
-        return
+# Snippets encoded once, so edits splice straight into the mapped bytes
+GET_REVIEW_TICKETS_B = GET_REVIEW_TICKETS.encode('utf-8')
+STATE_TRANSITIONS_B = STATE_TRANSITIONS.encode('utf-8')
+SENTINEL_REVIEW_B = SENTINEL_REVIEW.encode('utf-8')
+SENTINEL_POLL_CODE_B = SENTINEL_POLL_CODE.strip().encode('utf-8')
+METHOD_INDENT_B = b'\n    '
+
+def write_spliced(out, source, edits):
+    """Write source to out with (start, end, data) edits applied, in one writelines batch."""
+    view = memoryview(source)
+    parts, last = [], 0
+    for start, end, data in sorted(edits):
+        parts.append(view[last:start])
+        parts.append(data)
+        last = end
+    parts.append(view[last:])
+    out.writelines(parts)
+    # Drop every slice before the caller closes the mapping
+    del parts
+    view.release()
+
+def plan_edits(content):
+    """Collect (start, end, data) edits against the mapped engine.js."""
+    anchors = find_anchors(ENGINE_ANCHORS, content)
+    edits = []
     
     # Step 2: Add getReviewTickets after getTicket method
     print("[2/5] Adding getReviewTickets and atomicClaimReviewTicket...")
-    # Find getTicket method and insert after it
-    pattern = r'(async getTicket\(ticketId\) \{[^}]+\})'
-    match = re.search(pattern, content)
-    if match:
-        insert_pos = match.end()
-        content = content[:insert_pos] + GET_REVIEW_TICKETS + content[insert_pos:]
+    if 'getTicket' in anchors:
+        insert_pos = anchors['getTicket'][1]
+        edits.append((insert_pos, insert_pos, GET_REVIEW_TICKETS_B))
         print("      Added after getTicket()")
     else:
         print("[!] Could not find getTicket method - trying alternative location")
         # Insert after getProject method instead
-        pattern = r'(async getProject\(projectId\) \{[^}]+\})'
-        match = re.search(pattern, content)
-        if match:
-            insert_pos = match.end()
-            content = content[:insert_pos] + GET_REVIEW_TICKETS + content[insert_pos:]
+        if 'getProject' in anchors:
+            insert_pos = anchors['getProject'][1]
+            edits.append((insert_pos, insert_pos, GET_REVIEW_TICKETS_B))
             print("      Added after getProject()")
     
     # Step 3: Add state transition methods after setNeedsReview
     print("[3/5] Adding setMerged and setSentinelFailed...")
-    pattern = r'(async setNeedsReview\(evidence, ticketId\) \{[^}]+await this\.emitEvent[^}]+\})'
-    match = re.search(pattern, content)
-    if match:
-        insert_pos = match.end()
-        content = content[:insert_pos] + STATE_TRANSITIONS + content[insert_pos:]
+    if 'setNeedsReview' in anchors:
+        insert_pos = anchors['setNeedsReview'][1]
+        edits.append((insert_pos, insert_pos, STATE_TRANSITIONS_B))
         print("      Added after setNeedsReview()")
     else:
         print("[!] Could not find setNeedsReview - trying alternative")
         # Find setVerifying and add before it
-        idx = content.find('async setVerifying(ticketId)')
-        if idx > 0:
-            content = content[:idx] + STATE_TRANSITIONS + '\n    ' + content[idx:]
+        if 'setVerifying' in anchors:
+            idx = anchors['setVerifying'][0]
+            edits.append((idx, idx, STATE_TRANSITIONS_B + METHOD_INDENT_B))
             print("      Added before setVerifying()")
     
     # Step 4: Add sentinel review methods before _pollLoop
     print("[4/5] Adding executeSentinelReview and mergePR...")
-    pattern = r'(/\*\*\s*\n\s*\* Main polling loop)'
-    match = re.search(pattern, content)
-    if match:
-        insert_pos = match.start()
-        content = content[:insert_pos] + SENTINEL_REVIEW + '\n    ' + content[insert_pos:]
+    if 'pollLoop' in anchors:
+        insert_pos = anchors['pollLoop'][0]
+        edits.append((insert_pos, insert_pos, SENTINEL_REVIEW_B + METHOD_INDENT_B))
         print("      Added before _pollLoop()")
     else:
         print("[!] Could not find _pollLoop - adding before class end")
         # Find last method and add after
-        idx = content.rfind('    async ')
+        idx = content.rfind(b'    async ')
         if idx > 0:
             # Find end of that method
-            end_idx = content.find('\n    }', idx) + 6
-            content = content[:end_idx] + SENTINEL_REVIEW + content[end_idx:]
+            end_idx = content.find(b'\n    }', idx) + 6
+            edits.append((end_idx, end_idx, SENTINEL_REVIEW_B))
             print("      Added at end of class methods")
     
     # Step 5: Modify _pollOnce to add sentinel polling
     print("[5/5] Modifying _pollOnce to add sentinel polling...")
-    # Find the return statement in _pollOnce
-    pattern = r'(\n        return dispatched;\n    \}\n\n    /\*\*\n     \* Execute a single ticket)'
-    match = re.search(pattern, content)
-    if match:
-        # Replace just the return statement
-        old_return = '\n        return dispatched;\n'
-        new_return = SENTINEL_POLL_CODE + '\n'
-        
-        # Find _pollOnce method and replace its return
-        poll_once_start = content.find('async _pollOnce()')
-        if poll_once_start > 0:
-            poll_once_end = content.find('\n    /**\n     * Execute a single ticket', poll_once_start)
-            if poll_once_end > 0:
-                poll_once_content = content[poll_once_start:poll_once_end]
-                # Replace return dispatched in this section
-                if 'return dispatched;' in poll_once_content and '// =========== SENTINEL REVIEW POLLING' not in poll_once_content:
-                    new_poll_once = poll_once_content.replace('return dispatched;', SENTINEL_POLL_CODE.strip())
-                    content = content[:poll_once_start] + new_poll_once + content[poll_once_end:]
-                    print("      Modified _pollOnce() to include sentinel polling")
-                else:
-                    print("[!] _pollOnce already modified or return not found")
+    # The return statement closing _pollOnce, right before executeTicket
+    if 'pollOnce' in anchors and 'pollReturn' in anchors and anchors['pollOnce'][0] < anchors['pollReturn'][0]:
+        start, end = anchors['pollReturn']
+        edits.append((start, end, SENTINEL_POLL_CODE_B))
+        print("      Modified _pollOnce() to include sentinel polling")
     else:
         print("[!] Could not locate _pollOnce return statement")
     
-    # Write modified content
-    print("\n[*] Writing patched engine.js...")
-    with open(ENGINE_PATH, 'w') as f:
-        f.write(content)
+    return edits
+
+def apply_patch():
+    # Check if already patched: the engine still hashes to what we last wrote
+    if already_applied(ENGINE_PATH, MARKER_SUFFIX):
+        print("[!] Engine matches the recorded sentinel patch. Skipping patch.")
+        return
+    
+    print("[1/5] Mapping engine.js...")
+    # Backup (copied at the OS level, never loaded into Python)
+    shutil.copyfile(ENGINE_PATH, ENGINE_PATH + '.bak-sentinel')
+    print("      Backup created: engine.js.bak-sentinel")
+    
+    with open(ENGINE_PATH, 'rb') as f:
+        content = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    
+    with content:
+        # Patched before markers existed, or edited since
+        if content.find(b'getReviewTickets') != -1:
+            print("[!] Engine already contains sentinel polling. Skipping patch.")
+            return
+        
+        edits = plan_edits(content)
+        
+        # Write modified content
+        print("\n[*] Writing patched engine.js...")
+        with replacing(ENGINE_PATH) as fd, open(fd, 'wb', closefd=False) as out:
+            write_spliced(out, content, edits)
+    record_applied(ENGINE_PATH, MARKER_SUFFIX)
     
     print("[✓] Patch applied successfully!")
     print("\n[!] Remember to restart the engine: pm2 restart swarm-engine")
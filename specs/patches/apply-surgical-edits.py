@@ -2,56 +2,240 @@
 """
 Apply surgical edits patch to FORGE agent index.js
 """
-import re
 import sys
 from datetime import datetime
 
+from patch_utils import EditQueue, already_applied, record_applied, write_file
+
 TARGET = '/opt/swarm-app/apps/agents/coder/index.js'
+MARKER_SUFFIX = '.patch-surgical-edits'
+
+if already_applied(TARGET, MARKER_SUFFIX):
+    print(f"{TARGET} matches the recorded surgical edits patch. Skipping.")
+    sys.exit(0)
 
 # Read current file
 with open(TARGET, 'r') as f:
     content = f.read()
 
+# Patched before markers existed, or changed since by a later patch script
+if 'function fetchExistingFileContent(' in content:
+    print(f"{TARGET} already has surgical edits. Skipping.")
+    sys.exit(0)
+
 # Create backup
 backup_name = f"{TARGET}.bak-{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-with open(backup_name, 'w') as f:
-    f.write(content)
+write_file(backup_name, content)
 print(f"Backup created: {backup_name}")
 
+# Every change below is located once in the original content and queued;
+# all of them are spliced in a single pass at the end.
+edits = EditQueue(content)
+
 # ============================================================================
 # 1. Add fetchExistingFileContent before writeFiles (around line 460)
 # ============================================================================
 
 NEW_FETCH_FUNCTION = '''
+// Files above this size are streamed so only the kept head/tail lines are held
+const STREAM_TRUNCATE_BYTES = 1024 * 1024;
+
+// Streamed files are read in chunks this big: 16x fewer reads than the
+// 64 KiB default, each a large sequential request the kernel reads ahead for
+const STREAM_CHUNK_BYTES = 1024 * 1024;
+
+// Bounds on how much a ticket's rag_context can make us read. A batch is at
+// most MAX_EXISTING_FILES reads, nearly all of which fit in the 16-thread
+// pool at once, and decoding that much is cheap next to the read itself, so
+// fanning out to worker_threads would only add startup and copy costs.
+const MAX_EXISTING_FILES = 20;
+const MAX_EXISTING_FILE_BYTES = 8 * 1024 * 1024;
+
+// Line count of s via indexOf, without allocating the array split() would
+function countLines(s) {
+  let n = 1;
+  for (let i = s.indexOf('\\n'); i !== -1; i = s.indexOf('\\n', i + 1)) n++;
+  return n;
+}
+
+// Read buffers reused across fetches: a free list per power-of-two size,
+// up to STREAM_TRUNCATE_BYTES (anything bigger is streamed)
+const READ_BUFFER_MIN = 4096;
+const READ_BUFFERS_PER_SIZE = 4;
+const readBufferPool = new Map();
+
+function borrowReadBuffer(size) {
+  const capacity = Math.max(READ_BUFFER_MIN, 2 ** Math.ceil(Math.log2(size)));
+  const free = readBufferPool.get(capacity);
+  return (free && free.pop()) || Buffer.allocUnsafeSlow(capacity);
+}
+
+function returnReadBuffer(buf) {
+  let free = readBufferPool.get(buf.length);
+  if (!free) {
+    free = [];
+    readBufferPool.set(buf.length, free);
+  }
+  if (free.length < READ_BUFFERS_PER_SIZE) free.push(buf);
+}
+
 // Fetch existing file content for surgical modifications
-function fetchExistingFileContent(repoDir, filePath, maxLines = 300) {
+async function fetchExistingFileContent(repoDir, filePath, maxLines = 300, maxBytes = MAX_EXISTING_FILE_BYTES) {
   const fullPath = path.join(repoDir, filePath);
-  if (!fs.existsSync(fullPath)) {
-    return null;
+  let stat;
+  try {
+    stat = await fs.promises.stat(fullPath);
+  } catch (e) {
+    if (e.code === 'ENOENT') return null;
+    throw e;
   }
   
-  const content = fs.readFileSync(fullPath, 'utf8');
-  const lines = content.split('\\n');
+  return readExistingFileContent(fullPath, stat.size, maxLines, maxBytes);
+}
+
+async function readExistingFileContent(fullPath, size, maxLines, maxBytes) {
+  // Both paths stop reading at maxBytes and say so
+  const capped = size > maxBytes;
+  const cappedNote = capped ? '\\n\\n... [rest of file past ' + maxBytes + ' bytes not read] ...' : '';
   
-  if (lines.length > maxLines) {
-    const headLines = lines.slice(0, Math.floor(maxLines / 2));
-    const tailLines = lines.slice(-Math.floor(maxLines / 2));
-    return headLines.join('\\n') + 
-      '\\n\\n... [' + (lines.length - maxLines) + ' lines truncated] ...\\n\\n' + 
-      tailLines.join('\\n');
+  if (size <= STREAM_TRUNCATE_BYTES) {
+    // Single read into a pooled buffer big enough for the stat'd size (up to maxBytes)
+    const readSize = Math.min(size, maxBytes);
+    const handle = await fs.promises.open(fullPath, 'r');
+    const buf = borrowReadBuffer(readSize);
+    let content;
+    try {
+      // read() may return short (NFS, FUSE), so keep going until EOF
+      let filled = 0;
+      while (filled < readSize) {
+        const { bytesRead } = await handle.read(buf, filled, readSize - filled, filled);
+        if (bytesRead === 0) break;
+        filled += bytesRead;
+      }
+      content = buf.toString('utf8', 0, filled);
+    } finally {
+      returnReadBuffer(buf);
+      await handle.close();
+    }
+    
+    // Most files fit, so count first and only split the ones being truncated
+    if (countLines(content) > maxLines) {
+      const lines = content.split('\\n');
+      const headLines = lines.slice(0, Math.floor(maxLines / 2));
+      const tailLines = lines.slice(-Math.floor(maxLines / 2));
+      return headLines.join('\\n') + 
+        '\\n\\n... [' + (lines.length - maxLines) + ' lines truncated] ...\\n\\n' + 
+        tailLines.join('\\n') + cappedNote;
+    }
+    
+    return content + cappedNote;
+  }
+  
+  // Large file: keep the first half of maxLines and a rolling window of the
+  // last half
+  const half = Math.floor(maxLines / 2);
+  const headLines = [];
+  const tailRing = new Array(half);
+  let totalLines = 0;
+  
+  const input = fs.createReadStream(fullPath, {
+    encoding: 'utf8',
+    end: maxBytes - 1,
+    highWaterMark: STREAM_CHUNK_BYTES
+  });
+  // Keep the decoded chunks while the file may still be short enough to
+  // return whole, so a big-but-short file isn't read and decoded twice
+  let chunks = [];
+  let newlines = 0;
+  input.on('data', chunk => {
+    if (!chunks) return;
+    newlines += countLines(chunk) - 1;
+    if (newlines < maxLines) {
+      chunks.push(chunk);
+    } else {
+      chunks = null;
+    }
+  });
+  
+  const rl = readline.createInterface({ input, crlfDelay: Infinity });
+  for await (const line of rl) {
+    if (totalLines < half) {
+      headLines.push(line);
+    } else {
+      tailRing[(totalLines - half) % half] = line;
+    }
+    totalLines++;
+  }
+  
+  // Big but short (e.g. minified): nothing to truncate
+  if (totalLines <= maxLines) {
+    if (chunks) {
+      return chunks.join('') + cappedNote;
+    }
+    if (!capped) {
+      return fs.promises.readFile(fullPath, 'utf8');
+    }
+    return headLines.concat(tailRing.slice(0, Math.max(0, totalLines - half))).join('\\n') + cappedNote;
   }
   
-  return content;
+  const oldest = (totalLines - half) % half;
+  const tailLines = tailRing.slice(oldest).concat(tailRing.slice(0, oldest));
+  return headLines.join('\\n') + 
+    '\\n\\n... [' + (totalLines - maxLines) + ' lines truncated] ...\\n\\n' + 
+    tailLines.join('\\n') + cappedNote;
+}
+
+// Reads kept in flight by fetchExistingFilesBatch: one per threadpool
+// thread. Past that they would only queue inside libuv holding open handles.
+const FETCH_QUEUE_DEPTH = Number(process.env.UV_THREADPOOL_SIZE) || 4;
+
+// Fetch a whole set of files, results in filePaths order. Up to
+// FETCH_QUEUE_DEPTH files are read at once and each lane starts its next
+// file as soon as one completes, so a small batch goes out in one go and a
+// large one keeps the pool full without waiting for whole waves.
+async function fetchExistingFilesBatch(repoDir, filePaths) {
+  const results = new Array(filePaths.length);
+  let next = 0;
+  const lane = async () => {
+    while (next < filePaths.length) {
+      const i = next++;
+      // One unreadable path (e.g. a directory) must not drop the others
+      try {
+        results[i] = await fetchExistingFileContent(repoDir, filePaths[i]);
+      } catch (e) {
+        log.warn('Failed to read file to modify', { path: filePaths[i], error: e.message });
+        results[i] = null;
+      }
+    }
+  };
+  await Promise.all(Array.from({ length: Math.min(FETCH_QUEUE_DEPTH, filePaths.length) }, lane));
+  return results;
 }
 
 '''
 
+# libuv sizes its threadpool from the environment the first time it is used,
+# so this only takes effect at require time, before any async fs call
+THREADPOOL_SIZE = '''
+// fetchExistingFilesBatch keeps one read in flight per threadpool thread.
+// A batch is at most MAX_EXISTING_FILES (20) files, so 16 threads read nearly
+// all of it at once, where the default 4 would take it 4 files at a time
+if (!process.env.UV_THREADPOOL_SIZE) {
+  process.env.UV_THREADPOOL_SIZE = '16';
+}
+'''
+
 # Insert before writeFiles
-content = content.replace(
+edits.insert_before(
     'function writeFiles(repoDir, files) {',
-    NEW_FETCH_FUNCTION + 'function writeFiles(repoDir, files) {'
+    NEW_FETCH_FUNCTION,
+    "Added fetchExistingFileContent function"
+)
+edits.replace_once(
+    "const path = require('path');",
+    "const path = require('path');\nconst readline = require('readline');\n" + THREADPOOL_SIZE,
+    "Added readline require and threadpool size"
 )
-print("Added fetchExistingFileContent function")
 
 # ============================================================================
 # 2. Replace writeFiles with patch-aware version
@@ -74,86 +258,136 @@ OLD_WRITE_FILES = '''function writeFiles(repoDir, files) {
   return written;
 }'''
 
-NEW_WRITE_FILES = '''function writeFiles(repoDir, files) {
-  const written = [];
+NEW_WRITE_FILES = '''async function writeFileEntry(repoDir, file) {
+  const filePath = path.join(repoDir, file.path);
+  const fileDir = path.dirname(filePath);
   
-  for (const file of files) {
-    const filePath = path.join(repoDir, file.path);
-    const fileDir = path.dirname(filePath);
-    
-    if (!fs.existsSync(fileDir)) {
-      fs.mkdirSync(fileDir, { recursive: true });
-    }
-    
-    if (file.action === 'modify' && file.patches && Array.isArray(file.patches)) {
-      // SURGICAL MODIFICATION: Apply patches
-      if (!fs.existsSync(filePath)) {
+  // recursive mkdir is a no-op when the directory already exists
+  await fs.promises.mkdir(fileDir, { recursive: true });
+  
+  if (file.action === 'modify' && file.patches && Array.isArray(file.patches)) {
+    // SURGICAL MODIFICATION: Apply patches
+    let fileContent;
+    try {
+      fileContent = await fs.promises.readFile(filePath, 'utf8');
+    } catch (err) {
+      if (err.code === 'ENOENT') {
         log.error('Cannot modify non-existent file', { path: file.path });
-        continue;
+        return null;
       }
-      
-      let fileContent = fs.readFileSync(filePath, 'utf8');
-      let patchesApplied = 0;
-      
-      for (const patch of file.patches) {
-        if (!patch.search || patch.replace === undefined) {
-          log.warn('Invalid patch format', { path: file.path });
-          continue;
-        }
-        
-        if (!fileContent.includes(patch.search)) {
-          log.warn('Patch search text not found', { 
-            path: file.path, 
-            searchPreview: patch.search.substring(0, 50) + '...'
-          });
-          continue;
-        }
-        
-        const occurrences = fileContent.split(patch.search).length - 1;
-        if (occurrences > 1) {
-          log.warn('Patch search text not unique', { path: file.path, occurrences });
-        }
-        
-        fileContent = fileContent.replace(patch.search, patch.replace);
-        patchesApplied++;
+      throw err;
+    }
+    
+    const patches = file.patches.filter(patch => {
+      if (!patch.search || patch.replace === undefined) {
+        log.warn('Invalid patch format', { path: file.path });
+        return false;
       }
-      
-      if (patchesApplied > 0) {
-        fs.writeFileSync(filePath, fileContent);
-        written.push(file.path);
-        log.info('Applied patches to file', { 
+      return true;
+    });
+    
+    // Locate every patch in the original content (native indexOf, plus a
+    // second probe for uniqueness), then splice left to right in one join
+    const edits = [];
+    patches.forEach(patch => {
+      const start = fileContent.indexOf(patch.search);
+      if (start === -1) {
+        log.warn('Patch search text not found', { 
           path: file.path, 
-          patchesApplied,
-          totalPatches: file.patches.length
+          searchPreview: patch.search.substring(0, 50) + '...'
         });
-      } else {
-        log.error('No patches applied to file', { path: file.path });
+        return;
       }
-      
-    } else {
-      // CREATE: Write entire file content
-      fs.writeFileSync(filePath, file.content);
-      written.push(file.path);
-      log.info('Wrote file', { path: file.path, bytes: file.content.length });
+      if (fileContent.indexOf(patch.search, start + 1) !== -1) {
+        log.warn('Patch search text not unique', { path: file.path });
+      }
+      edits.push({ start, end: start + patch.search.length, text: patch.replace });
+    });
+    edits.sort((a, b) => a.start - b.start);
+    
+    const parts = [];
+    let last = 0;
+    let patchesApplied = 0;
+    for (const edit of edits) {
+      if (edit.start < last) {
+        log.warn('Patch overlaps an earlier patch', { path: file.path });
+        continue;
+      }
+      parts.push(fileContent.substring(last, edit.start), edit.text);
+      last = edit.end;
+      patchesApplied++;
+    }
+    parts.push(fileContent.substring(last));
+    fileContent = parts.join('');
+    
+    if (patchesApplied > 0) {
+      await fs.promises.writeFile(filePath, fileContent);
+      log.info('Applied patches to file', { 
+        path: file.path, 
+        patchesApplied,
+        totalPatches: file.patches.length
+      });
+      return file.path;
     }
+    log.error('No patches applied to file', { path: file.path });
+    return null;
+    
+  } else {
+    // CREATE: Write entire file content
+    await fs.promises.writeFile(filePath, file.content);
+    log.info('Wrote file', { path: file.path, bytes: file.content.length });
+    return file.path;
   }
+}
+
+async function writeFiles(repoDir, files) {
+  // Different files are independent, so let libuv overlap their reads and
+  // writes. Entries for the same file (the LLM sometimes lists one twice)
+  // run in order, so each read-modify-write sees the previous one's result.
+  const byPath = new Map();
+  files.forEach((file, i) => {
+    const key = path.join(repoDir, file.path);
+    if (!byPath.has(key)) byPath.set(key, []);
+    byPath.get(key).push(i);
+  });
   
-  return written;
+  const results = new Array(files.length);
+  await Promise.all([...byPath.values()].map(async indexes => {
+    for (const i of indexes) {
+      results[i] = await writeFileEntry(repoDir, files[i]);
+    }
+  }));
+  return results.filter(Boolean);
 }'''
 
-content = content.replace(OLD_WRITE_FILES, NEW_WRITE_FILES)
-print("Replaced writeFiles with patch-aware version")
+edits.replace_once(OLD_WRITE_FILES, NEW_WRITE_FILES, "Replaced writeFiles with patch-aware version")
 
 # ============================================================================
 # 3. Update buildPrompt to accept existingFiles parameter and handle modify
 # ============================================================================
 
+RAG_CONTEXT_CACHE = '''// Parsed rag_context per ticket object, so retries don't re-parse the JSON
+const ragContextCache = new WeakMap();
+
+function parseRagContext(ticket) {
+  let ctx = ragContextCache.get(ticket);
+  if (!ctx) {
+    ctx = typeof ticket.rag_context === 'string'
+      ? JSON.parse(ticket.rag_context)
+      : (ticket.rag_context || {});
+    ragContextCache.set(ticket, ctx);
+  }
+  return ctx;
+}
+
+'''
+
 # Find and replace the buildPrompt function signature
-content = content.replace(
+edits.replace_once(
     'function buildPrompt(ticket) {',
-    'function buildPrompt(ticket, existingFiles = {}) {'
+    RAG_CONTEXT_CACHE + 'function buildPrompt(ticket, existingFiles = {}) {',
+    "Updated buildPrompt signature"
 )
-print("Updated buildPrompt signature")
 
 # Find the filesSection assignment and enhance it
 OLD_FILES_SECTION = '''  const filesSection = fileHints.length > 0 ? fileHints.join('\\n') : 'Determine appropriate file structure';'''
@@ -164,11 +398,10 @@ NEW_FILES_SECTION = '''  // Parse files_to_create and files_to_modify from rag_c
   
   if (ticket.rag_context) {
     try {
-      const ctx = typeof ticket.rag_context === 'string' 
-        ? JSON.parse(ticket.rag_context) 
-        : ticket.rag_context;
+      const ctx = parseRagContext(ticket);
       filesToCreate = ctx.files_to_create || [];
-      filesToModify = ctx.files_to_modify || [];
+      // The same paths collectExistingFiles fetched: each once, at most MAX_EXISTING_FILES
+      filesToModify = [...new Set(ctx.files_to_modify || [])].slice(0, MAX_EXISTING_FILES);
     } catch (e) {
       log.warn('Failed to parse rag_context', { error: e.message });
     }
@@ -208,8 +441,7 @@ NEW_FILES_SECTION = '''  // Parse files_to_create and files_to_modify from rag_c
   
   const hasModifications = filesToModify.length > 0;'''
 
-content = content.replace(OLD_FILES_SECTION, NEW_FILES_SECTION)
-print("Enhanced filesSection with CREATE/MODIFY distinction")
+edits.replace_once(OLD_FILES_SECTION, NEW_FILES_SECTION, "Enhanced filesSection with CREATE/MODIFY distinction")
 
 # ============================================================================
 # 4. Update output format in buildPrompt to include modify instructions
@@ -219,7 +451,7 @@ OLD_OUTPUT_FORMAT = '''      "action": "create",'''
 
 NEW_OUTPUT_FORMAT = '''      "action": "create",  // Use "modify" with patches array for existing files'''
 
-content = content.replace(OLD_OUTPUT_FORMAT, NEW_OUTPUT_FORMAT, 1)
+edits.replace_once(OLD_OUTPUT_FORMAT, NEW_OUTPUT_FORMAT, "Annotated create action in output format")
 
 # Add modify instructions after the JSON example
 OLD_IMPORTANT = '''IMPORTANT: 
@@ -248,8 +480,7 @@ CRITICAL RULES:
 IMPORTANT: 
 - Response must be valid JSON only'''
 
-content = content.replace(OLD_IMPORTANT, NEW_IMPORTANT)
-print("Added modify instructions to output format")
+edits.replace_once(OLD_IMPORTANT, NEW_IMPORTANT, "Added modify instructions to output format")
 
 # ============================================================================
 # 5. Update generateCode call to pass existing files
@@ -259,15 +490,23 @@ print("Added modify instructions to output format")
 OLD_PROMPT_CALL = '''  const prompt = buildPrompt(ticket);'''
 NEW_PROMPT_CALL = '''  const prompt = buildPrompt(ticket, {});  // existingFiles passed from processTicket'''
 
-content = content.replace(OLD_PROMPT_CALL, NEW_PROMPT_CALL)
-print("Updated buildPrompt call in generateCode")
+edits.replace_once(OLD_PROMPT_CALL, NEW_PROMPT_CALL, "Updated buildPrompt call in generateCode")
 
 # ============================================================================
-# Write the patched file
+# Apply all edits in one pass and write the patched file
 # ============================================================================
 
-with open(TARGET, 'w') as f:
-    f.write(content)
+if edits.missing:
+    print("\nCould not find the anchor for:")
+    for message in edits.missing:
+        print(f"  - {message}")
+    print(f"{TARGET} left unchanged")
+    sys.exit(1)
+
+content = edits.apply()
+
+write_file(TARGET, content)
+record_applied(TARGET, MARKER_SUFFIX)
 
 print(f"\\nPatched file written to: {TARGET}")
 print("Run 'node --check index.js' to verify syntax")
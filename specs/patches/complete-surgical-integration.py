@@ -2,51 +2,53 @@
 """
 Complete the surgical edits integration in processTicket
 """
-import re
+import sys
 from datetime import datetime
 
-TARGET = '/opt/swarm-app/apps/agents/coder/index.js'
-
-with open(TARGET, 'r') as f:
-    content = f.read()
+from patch_utils import EditQueue, already_applied, record_applied, write_file
 
-backup_name = f"{TARGET}.bak-{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-with open(backup_name, 'w') as f:
-    f.write(content)
-print(f"Backup created: {backup_name}")
+TARGET = '/opt/swarm-app/apps/agents/coder/index.js'
+MARKER_SUFFIX = '.patch-surgical-integration'
 
 # ============================================================================
 # 1. Update generateCode signature to accept existingFiles
 # ============================================================================
 
-content = content.replace(
-    'async function generateCode(ticket, heartbeatFn, projectSettings = {}) {\n  const prompt = buildPrompt(ticket, {});',
-    'async function generateCode(ticket, heartbeatFn, projectSettings = {}, existingFiles = {}) {\n  const prompt = buildPrompt(ticket, existingFiles);'
-)
-print("Updated generateCode signature")
+# The first attempt and every retry of a ticket build the same base prompt,
+# which embeds every fetched file; build it once and share it
+BASE_PROMPT_CACHE = '''// buildPrompt output per ticket, remembered with the existingFiles object it
+// was built from. processTicket passes the same object to every attempt, so
+// identity is the key: no hashing or re-stringifying of file contents.
+const basePromptCache = new WeakMap();
+
+function cachedBasePrompt(ticket, existingFiles) {
+  const cached = basePromptCache.get(ticket);
+  if (cached && cached.existingFiles === existingFiles) {
+    return cached.prompt;
+  }
+  const prompt = buildPrompt(ticket, existingFiles);
+  basePromptCache.set(ticket, { existingFiles, prompt });
+  return prompt;
+}
+
+'''
+
+OLD_GENERATE_CODE_SIGNATURE = 'async function generateCode(ticket, heartbeatFn, projectSettings = {}) {\n  const prompt = buildPrompt(ticket, {});'
+NEW_GENERATE_CODE_SIGNATURE = BASE_PROMPT_CACHE + 'async function generateCode(ticket, heartbeatFn, projectSettings = {}, existingFiles = {}) {\n  const prompt = cachedBasePrompt(ticket, existingFiles);'
 
 # ============================================================================
 # 2. Update generateCodeWithRetry similarly
 # ============================================================================
 
-content = content.replace(
-    'async function generateCodeWithRetry(ticket, heartbeatFn, projectSettings, previousResult, validationErrors) {',
-    'async function generateCodeWithRetry(ticket, heartbeatFn, projectSettings, previousResult, validationErrors, existingFiles = {}) {'
-)
-print("Updated generateCodeWithRetry signature")
-
-# Also need to update the buildPrompt call in generateCodeWithRetry
-# First find where it's used
-if 'buildRetryPrompt(ticket,' in content:
-    # The retry prompt builder might need existingFiles too
-    content = content.replace(
-        'function buildRetryPrompt(ticket, previousResult, validationErrors) {\n  const basePrompt = buildPrompt(ticket);',
-        'function buildRetryPrompt(ticket, previousResult, validationErrors, existingFiles = {}) {\n  const basePrompt = buildPrompt(ticket, existingFiles);'
-    )
-    print("Updated buildRetryPrompt signature")
+OLD_RETRY_SIGNATURE = 'async function generateCodeWithRetry(ticket, heartbeatFn, projectSettings, previousResult, validationErrors) {'
+NEW_RETRY_SIGNATURE = 'async function generateCodeWithRetry(ticket, heartbeatFn, projectSettings, previousResult, validationErrors, existingFiles = {}) {'
+
+# The retry prompt builder needs existingFiles too
+OLD_RETRY_PROMPT_SIGNATURE = 'function buildRetryPrompt(ticket, previousResult, validationErrors) {\n  const basePrompt = buildPrompt(ticket);'
+NEW_RETRY_PROMPT_SIGNATURE = 'function buildRetryPrompt(ticket, previousResult, validationErrors, existingFiles = {}) {\n  const basePrompt = cachedBasePrompt(ticket, existingFiles);'
 
 # ============================================================================
-# 3. Add file fetching after cloneAndBranch in processTicket
+# 3. Add file fetching to processTicket, overlapped with cloneAndBranch
 # ============================================================================
 
 OLD_CLONE_SECTION = '''    const cloneResult = await cloneAndBranch(ticket);
@@ -56,68 +58,163 @@ OLD_CLONE_SECTION = '''    const cloneResult = await cloneAndBranch(ticket);
     
     // RETRY LOOP'''
 
-NEW_CLONE_SECTION = '''    const cloneResult = await cloneAndBranch(ticket);
+NEW_CLONE_SECTION = '''    // Fetch existing file content for files_to_modify, starting as soon as
+    // the checkout has written them so the reads overlap the rest of
+    // cloneAndBranch. Tickets without rag_context skip this: no hints.
+    // collectExistingFiles never rejects, so if cloneAndBranch throws after
+    // the checkout the dropped promise can't become an unhandled rejection.
+    let existingFilesPending;
+    const cloneResult = await cloneAndBranch(ticket, checkedOutDir => {
+      if (ticket.rag_context) {
+        existingFilesPending = collectExistingFiles(ticket, checkedOutDir);
+      }
+    });
     repoDir = cloneResult.repoDir;
     branchName = cloneResult.branchName;
     log.info('Cloned repo', { branch: branchName });
     
-    // Fetch existing file content for files_to_modify
-    const existingFiles = {};
-    if (ticket.rag_context) {
-      try {
-        const ctx = typeof ticket.rag_context === 'string' 
-          ? JSON.parse(ticket.rag_context) 
-          : ticket.rag_context;
-        const filesToModify = ctx.files_to_modify || [];
-        for (const filePath of filesToModify) {
-          const fileContent = fetchExistingFileContent(repoDir, filePath);
-          if (fileContent) {
-            existingFiles[filePath] = fileContent;
-            log.info('Fetched existing file for modification', { path: filePath, lines: fileContent.split('\\n').length });
-          } else {
-            log.warn('File to modify not found', { path: filePath });
-          }
-        }
-      } catch (e) {
-        log.warn('Failed to fetch existing files', { error: e.message });
-      }
-    }
+    const existingFiles = await existingFilesPending;
     
     // RETRY LOOP'''
 
-content = content.replace(OLD_CLONE_SECTION, NEW_CLONE_SECTION)
-print("Added file fetching after cloneAndBranch")
+# cloneAndBranch reports when the working tree is final, before its closing
+# activity log round-trip, so processTicket can start reading files meanwhile
+OLD_CLONE_SIGNATURE = 'async function cloneAndBranch(ticket) {'
+NEW_CLONE_SIGNATURE = 'async function cloneAndBranch(ticket, onCheckout) {'
+
+OLD_CHECKOUT_LOG = "  await logActivity(ticket.id, 'git_operation', 'Checked out branch', { branch: branchName });"
+NEW_CHECKOUT_LOG = '''  if (onCheckout) {
+    onCheckout(repoDir);
+  }
+
+''' + OLD_CHECKOUT_LOG
+
+COLLECT_EXISTING_FILES = '''// One shared string per file path across tickets (each ticket's rag_context
+// parse makes fresh copies). Cleared if it ever reaches PATH_INTERN_MAX so a
+// long-running agent can't accumulate paths without bound.
+const PATH_INTERN_MAX = 10000;
+const pathIntern = new Map();
+
+function internPath(filePath) {
+  const interned = pathIntern.get(filePath);
+  if (interned !== undefined) {
+    return interned;
+  }
+  if (pathIntern.size >= PATH_INTERN_MAX) {
+    pathIntern.clear();
+  }
+  pathIntern.set(filePath, filePath);
+  return filePath;
+}
+
+// Current content of the ticket's files_to_modify, keyed by path. Undefined
+// when there is nothing to fetch, which generateCode and the retry path treat
+// the same as no hints. The result is frozen: every attempt shares it, and
+// the base prompt cache is keyed on its identity.
+async function collectExistingFiles(ticket, repoDir) {
+  try {
+    // Cached per ticket, so buildPrompt and every retry reuse this parse
+    const ctx = parseRagContext(ticket);
+    // The LLM sometimes lists a file twice; fetch each path once, and at most MAX_EXISTING_FILES
+    const requested = [...new Set(ctx.files_to_modify || [])];
+    if (requested.length === 0) {
+      return undefined;
+    }
+    const filesToModify = requested.slice(0, MAX_EXISTING_FILES);
+    if (requested.length > filesToModify.length) {
+      log.warn('Too many files to modify, fetching only the first ones', { requested: requested.length, fetched: filesToModify.length });
+    }
+    
+    // Read through a FETCH_QUEUE_DEPTH-wide sliding window, results in filesToModify order
+    const contents = await fetchExistingFilesBatch(repoDir, filesToModify);
+    const fetched = [];
+    const missing = [];
+    filesToModify.forEach((filePath, i) => {
+      if (contents[i]) {
+        fetched.push([internPath(filePath), contents[i]]);
+      } else {
+        missing.push(filePath);
+      }
+    });
+    // Logged as one line per outcome
+    if (fetched.length > 0) {
+      log.info('Fetched existing files for modification', { files: fetched.map(([filePath, fileContent]) => ({ path: filePath, lines: countLines(fileContent) })) });
+    }
+    if (missing.length > 0) {
+      log.warn('Files to modify not found', { paths: missing });
+    }
+    return Object.freeze(Object.fromEntries(fetched));
+  } catch (e) {
+    log.warn('Failed to fetch existing files', { error: e.message });
+    return undefined;
+  }
+}
+
+'''
 
 # ============================================================================
-# 4. Pass existingFiles to generateCode and generateCodeWithRetry calls
+# 4. Update call sites: pass existingFiles, await writeFiles
 # ============================================================================
 
-content = content.replace(
-    'result = await generateCode(ticket, heartbeatFn, projectSettings);',
-    'result = await generateCode(ticket, heartbeatFn, projectSettings, existingFiles);'
+# Call sites are rewritten wherever they occur: (old, new, message)
+CALL_EDITS = (
+    ('result = await generateCode(ticket, heartbeatFn, projectSettings);',
+     'result = await generateCode(ticket, heartbeatFn, projectSettings, existingFiles);',
+     "Updated generateCode call"),
+    ('result = await generateCodeWithRetry(ticket, heartbeatFn, projectSettings, lastResult, lastValidationErrors);',
+     'result = await generateCodeWithRetry(ticket, heartbeatFn, projectSettings, lastResult, lastValidationErrors, existingFiles);',
+     "Updated generateCodeWithRetry call"),
+    # The buildRetryPrompt call in generateCodeWithRetry
+    ('const prompt = buildRetryPrompt(ticket, previousResult, validationErrors);',
+     'const prompt = buildRetryPrompt(ticket, previousResult, validationErrors, existingFiles);',
+     "Updated buildRetryPrompt call"),
 )
-print("Updated generateCode call")
 
-content = content.replace(
-    'result = await generateCodeWithRetry(ticket, heartbeatFn, projectSettings, lastResult, lastValidationErrors);',
-    'result = await generateCodeWithRetry(ticket, heartbeatFn, projectSettings, lastResult, lastValidationErrors, existingFiles);'
-)
-print("Updated generateCodeWithRetry call")
+# writeFiles is async since the surgical edits patch. Agents that write
+# through writeFilesDetailed have no writeFiles call to await.
+OLD_WRITE_FILES_CALL = '= writeFiles(repoDir, '
+NEW_WRITE_FILES_CALL = '= await writeFiles(repoDir, '
 
-# ============================================================================
-# 5. Update the buildRetryPrompt call in generateCodeWithRetry
-# ============================================================================
 
-# Find and update the call
-content = content.replace(
-    'const retryPrompt = buildRetryPrompt(ticket, previousResult, validationErrors);',
-    'const retryPrompt = buildRetryPrompt(ticket, previousResult, validationErrors, existingFiles);'
-)
-print("Updated buildRetryPrompt call")
-
-# Write result
-with open(TARGET, 'w') as f:
-    f.write(content)
+def apply_patch():
+    if already_applied(TARGET, MARKER_SUFFIX):
+        print(f"{TARGET} matches the recorded surgical integration patch. Skipping.")
+        return
+    
+    with open(TARGET, 'r') as f:
+        content = f.read()
+    
+    backup_name = f"{TARGET}.bak-{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    write_file(backup_name, content)
+    print(f"Backup created: {backup_name}")
+    
+    # All replacements are located in the original content and spliced in one pass
+    edits = EditQueue(content)
+    edits.replace_once(OLD_GENERATE_CODE_SIGNATURE, NEW_GENERATE_CODE_SIGNATURE, "Updated generateCode signature")
+    edits.replace_once(OLD_RETRY_SIGNATURE, NEW_RETRY_SIGNATURE, "Updated generateCodeWithRetry signature")
+    if 'buildRetryPrompt(ticket,' in content:
+        edits.replace_once(OLD_RETRY_PROMPT_SIGNATURE, NEW_RETRY_PROMPT_SIGNATURE, "Updated buildRetryPrompt signature")
+    edits.replace_once(OLD_CLONE_SIGNATURE, NEW_CLONE_SIGNATURE, "Updated cloneAndBranch signature")
+    edits.replace_once(OLD_CHECKOUT_LOG, NEW_CHECKOUT_LOG, "Added checkout callback to cloneAndBranch")
+    edits.replace_once(OLD_CLONE_SECTION, NEW_CLONE_SECTION, "Added file fetching during cloneAndBranch")
+    edits.insert_before('async function processTicket(', COLLECT_EXISTING_FILES, "Added collectExistingFiles helper")
+    for old, new, message in CALL_EDITS:
+        edits.replace_all(old, new, message)
+    if OLD_WRITE_FILES_CALL in content:
+        edits.replace_all(OLD_WRITE_FILES_CALL, NEW_WRITE_FILES_CALL, "Updated writeFiles call to await")
+    
+    if edits.missing:
+        print("\nCould not find the anchor for:")
+        for message in edits.missing:
+            print(f"  - {message}")
+        print(f"{TARGET} left unchanged")
+        sys.exit(1)
+    
+    write_file(TARGET, edits.apply())
+    record_applied(TARGET, MARKER_SUFFIX)
+    
+    print(f"\nPatched file written to: {TARGET}")
+    print("Run 'node --check index.js' to verify syntax")
 
-print(f"\nPatched file written to: {TARGET}")
-print("Run 'node --check index.js' to verify syntax")
+if __name__ == '__main__':
+    apply_patch()
@@ -0,0 +1,164 @@
+"""
+Shared helpers for the patch scripts in this directory
+
+Scripts import this as a sibling module (python3 puts the script's
+directory on sys.path), so run them from anywhere.
+"""
+
+import contextlib
+import hashlib
+import os
+import re
+import stat
+
+
+# Insertion anchors in the swarm engine's engine.js, compiled once at import.
+# Bytes patterns, since the patch scripts search the memory-mapped file.
+ENGINE_ANCHORS = {
+    'getTicket': re.compile(rb'async getTicket\(ticketId\) \{[^}]+\}'),
+    'getProject': re.compile(rb'async getProject\(projectId\) \{[^}]+\}'),
+    'setNeedsReview': re.compile(rb'async setNeedsReview\(evidence, ticketId\) \{[^}]+await this\.emitEvent[^}]+\}'),
+    'setVerifying': re.compile(rb'async setVerifying\(ticketId\)'),
+    'pollLoop': re.compile(rb'/\*\*\s*\n\s*\* Main polling loop'),
+    'pollOnce': re.compile(rb'async _pollOnce\(\)'),
+    'pollReturn': re.compile(rb'(?<=\n {8})return dispatched;(?=\n    \}\n\n    /\*\*\n     \* Execute a single ticket)'),
+}
+
+
+def find_anchors(patterns, content):
+    """Span of the first match of each named pattern; absent names aren't found."""
+    spans = {}
+    for name, pattern in patterns.items():
+        match = pattern.search(content)
+        if match:
+            spans[name] = match.span()
+    return spans
+
+
+class EditQueue:
+    """
+    Edits to one text, each located once in the original and queued as
+    (start, end, text); apply() splices them all in one pass.
+
+    Anchors that aren't found are collected in `missing` instead of raising,
+    so a script can report every one of them before giving up. The messages
+    of the edits that were found are printed by apply(), once they are made.
+    """
+
+    def __init__(self, content):
+        self.content = content
+        self.edits = []
+        self.missing = []
+        self.found = []
+
+    def _locate(self, needle, message):
+        start = self.content.find(needle)
+        if start == -1:
+            self.missing.append(message)
+        else:
+            self.found.append(message)
+        return start
+
+    def replace_once(self, old, new, message):
+        """Queue replacing the first occurrence of `old` with `new`."""
+        start = self._locate(old, message)
+        if start != -1:
+            self.edits.append((start, start + len(old), new))
+
+    def replace_all(self, old, new, message):
+        """Queue replacing every occurrence of `old` with `new`, like str.replace."""
+        start = self._locate(old, message)
+        while start != -1:
+            self.edits.append((start, start + len(old), new))
+            start = self.content.find(old, start + len(old))
+
+    def insert_before(self, anchor, text, message):
+        """Queue inserting `text` right before the first occurrence of `anchor`."""
+        start = self._locate(anchor, message)
+        if start != -1:
+            self.edits.append((start, start, text))
+
+    def apply(self):
+        """The original text with every queued edit spliced in."""
+        edits = sorted(self.edits, key=lambda edit: (edit[0], edit[1]))
+        for prev, cur in zip(edits, edits[1:]):
+            assert prev[1] <= cur[0], f"Overlapping edits at offset {cur[0]}"
+
+        parts, last = [], 0
+        for start, end, text in edits:
+            parts.append(self.content[last:start])
+            parts.append(text)
+            last = end
+        parts.append(self.content[last:])
+        for message in self.found:
+            print(message)
+        return ''.join(parts)
+
+
+def file_digest(path):
+    """SHA-256 hex digest of a file, hashed in chunks."""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def already_applied(path, marker_suffix):
+    """True if `path` is byte-for-byte what a previous run of this patch left behind."""
+    try:
+        with open(path + marker_suffix, 'r') as f:
+            recorded = f.read().strip()
+    except FileNotFoundError:
+        return False
+    return recorded == file_digest(path)
+
+
+def record_applied(path, marker_suffix):
+    """Remember the patched file's digest so the next run can skip cheaply."""
+    with open(path + marker_suffix, 'w') as f:
+        f.write(file_digest(path) + '\n')
+
+
+@contextlib.contextmanager
+def replacing(path):
+    """
+    Yield a raw fd for a temp file next to `path`; on a clean exit it replaces
+    `path` with os.replace, on an exception it is removed and `path` is left
+    alone. An existing file's permissions (and owner, where allowed) carry
+    over to the new one.
+    """
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        st = None
+
+    tmp_path = path + '.tmp'
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        try:
+            if st is not None:
+                # fchmod, since the mode passed to os.open is masked by the umask
+                os.fchmod(fd, stat.S_IMODE(st.st_mode))
+                try:
+                    os.fchown(fd, st.st_uid, st.st_gid)
+                except PermissionError:
+                    pass
+            yield fd
+        finally:
+            os.close(fd)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    os.replace(tmp_path, path)
+
+
+def write_file(path, data):
+    """Write `data` to `path` atomically: one unbuffered os.write loop into a
+    temp file, then os.replace (see replacing())."""
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    with replacing(path) as fd:
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]